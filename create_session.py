@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+"""Create and manage Dozlab lab sessions on a Kubernetes cluster.
+
+Renders lab-pod-with-sidecar.yaml for a session and drives the resulting
+Pod/Service/Secret through the Kubernetes API. Intended both as a CLI for
+operators and as a library for the Dozlab API service.
+
+Usage:
+    python create_session.py create --user-id user-456 --rootfs-url https://storage.../dozlab-k8s.ext4
+    python create_session.py status <session-id>
+    python create_session.py list
+    python create_session.py delete <session-id>
+"""
+
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
+import lab_pod_template
+
+# yaml and kubernetes are imported lazily at their use sites: together
+# they cost a few hundred milliseconds of startup, which would dominate
+# --help, argparse errors, and any subcommand that never touches them.
+
+
+def _import_yaml():
+    """Import PyYAML, preferring the libyaml C loader/dumper.
+
+    The C scanner/parser is 10-20x faster than the pure-Python one on
+    real manifests; fall back if PyYAML was built without libyaml.
+    """
+    import yaml
+
+    try:
+        from yaml import CSafeDumper, CSafeLoader
+    except ImportError:
+        from yaml import SafeDumper as CSafeDumper, SafeLoader as CSafeLoader
+    return yaml, CSafeLoader, CSafeDumper
+
+
+def _dumps_json(obj):
+    """Serialize for machine-consumable output, via orjson when available.
+
+    orjson emits bytes roughly 50x faster than yaml.dump and handles
+    datetimes natively; plain json is a drop-in fallback.
+    """
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(obj, indent=2, default=str).encode()
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2, default=str)
+
+
+def _loads_json(data):
+    """Parse JSON bytes, via orjson when available."""
+    try:
+        import orjson
+    except ImportError:
+        return json.loads(data)
+    return orjson.loads(data)
+
+
+LABEL_SELECTOR = "app=lab-environment"
+
+# URL path segments for the resource kinds the template may contain.
+_RESOURCE_PATHS = {"Pod": "pods", "Service": "services", "Secret": "secrets"}
+
+# The template uses shell-style ${VAR:-default} placeholders, which
+# string.Template does not understand. Defaults are stripped out up front
+# and folded into the substitution map instead.
+_DEFAULT_RE = re.compile(r"\$\{(\w+):-([^}]*)\}")
+
+# $VAR and ${VAR} placeholders. Unknown variables are left untouched, same
+# as string.Template.safe_substitute, but one precompiled pattern does the
+# whole leaf in a single C-level scan with no per-call Template object.
+_VAR_RE = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+
+
+class DozlabSessionManager:
+    """Manages the lifecycle of lab session resources in a namespace."""
+
+    def __init__(
+        self, template_path=None, namespace="default", watch=False, status_ttl=5.0
+    ):
+        self.namespace = namespace
+        # The built-in manifests come from lab_pod_template.build, which
+        # constructs the dicts directly in Python: no templating, no YAML.
+        # A custom template path keeps the parsed-YAML substitution path.
+        if template_path is None:
+            self.defaults = dict(lab_pod_template.DEFAULTS)
+            self._template_docs = None
+        else:
+            self.defaults, self._template_docs = self._load_template(template_path)
+        # Session cache fed by the watch thread (see _start_watch). One-shot
+        # CLI commands leave it off; long-lived embedders pass watch=True so
+        # status/list reads stop hitting the API server per call.
+        self._session_cache = {}
+        self._watch_thread = None
+        # TTL cache for the direct status path, so a dashboard polling
+        # every second without a watch costs one GET per status_ttl
+        # seconds instead of one per poll. Set status_ttl=0 to disable.
+        self.status_ttl = status_ttl
+        self._status_cache = {}
+
+        from kubernetes import client, config
+
+        try:
+            config.load_incluster_config()
+        except config.ConfigException:
+            config.load_kube_config()
+        # One shared ApiClient so every call reuses the same urllib3 pool:
+        # TLS handshakes are paid once, not per request, which matters both
+        # for the three concurrent creates and for tight status/list loops.
+        cfg = client.Configuration.get_default_copy()
+        cfg.connection_pool_maxsize = 16
+        self._api_client = client.ApiClient(cfg)
+        self.core_v1 = client.CoreV1Api(self._api_client)
+        if watch:
+            self._start_watch()
+
+    def close(self):
+        """Release the underlying HTTP connection pool."""
+        self._api_client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _peek_header(stream, keys=("apiVersion", "kind")):
+        """Read the leading top-level scalar keys of the first YAML document.
+
+        Walks the low-level event stream and stops as soon as the wanted
+        keys are seen (or the first document ends), so inspecting a
+        manifest's kind never builds the full node tree.
+        """
+        yaml, CSafeLoader, _ = _import_yaml()
+        wanted = set(keys)
+        found = {}
+        depth = 0
+        pending_key = None
+        for event in yaml.parse(stream, Loader=CSafeLoader):
+            if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+                depth += 1
+                pending_key = None
+            elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+                depth -= 1
+                if depth == 0:
+                    break
+            elif isinstance(event, yaml.ScalarEvent) and depth == 1:
+                if pending_key is None:
+                    pending_key = event.value
+                else:
+                    if pending_key in wanted:
+                        found[pending_key] = event.value
+                    pending_key = None
+            elif isinstance(event, yaml.DocumentEndEvent):
+                break
+            if wanted <= found.keys():
+                break
+        return found
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _names(session_id):
+        """Pod, Service, and Secret names for a session, memoized for
+        tight status/teardown loops."""
+        return (
+            f"lab-session-{session_id}",
+            f"lab-service-{session_id}",
+            f"lab-session-{session_id}-secrets",
+        )
+
+    @classmethod
+    def _load_template(cls, template_path):
+        """Load the template, using a JSON sidecar cache when it is fresh.
+
+        Short-lived CLI invocations would otherwise pay the YAML parse on
+        every run; JSON round-trips the parsed documents losslessly (the
+        template has no YAML-only types) and parses an order of magnitude
+        faster. The cache is regenerated whenever the YAML is newer.
+        """
+        cache_path = template_path + ".json"
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(template_path):
+                with open(cache_path) as f:
+                    cached = json.load(f)
+                return cached["defaults"], cached["docs"]
+        except (OSError, ValueError, KeyError):
+            pass  # missing or stale/corrupt cache; reparse below
+
+        yaml, CSafeLoader, _ = _import_yaml()
+        with open(template_path) as f:
+            raw = f.read()
+        # Cheap sanity check before committing to the full parse: the event
+        # stream stops after the header keys of the first document.
+        header = cls._peek_header(raw)
+        if header.get("kind") != "Pod":
+            raise ValueError(
+                f"{template_path}: first document must be a Pod, "
+                f"got {header.get('kind')!r}"
+            )
+        defaults = dict(_DEFAULT_RE.findall(raw))
+        # Parse the template once; create_session only has to substitute
+        # variables on the string leaves of the parsed documents instead of
+        # re-tokenizing ~17KB of YAML per call.
+        docs = list(yaml.load_all(_DEFAULT_RE.sub(r"${\1}", raw), Loader=CSafeLoader))
+        try:
+            with open(cache_path, "w") as f:
+                json.dump({"defaults": defaults, "docs": docs}, f)
+        except OSError:
+            pass  # read-only template directory; cache is best-effort
+        return defaults, docs
+
+    # Entropy pool for password generation: one os.urandom syscall refills
+    # 4KiB, so bulk session creation draws from memory instead of paying a
+    # getrandom round-trip per password.
+    _entropy_pool = b""
+    _entropy_offset = 0
+    _entropy_lock = threading.Lock()
+
+    @classmethod
+    def _generate_password(cls, length=24):
+        """Return a urlsafe password built from `length` random bytes."""
+        with cls._entropy_lock:
+            if cls._entropy_offset + length > len(cls._entropy_pool):
+                cls._entropy_pool = os.urandom(4096)
+                cls._entropy_offset = 0
+            raw = cls._entropy_pool[
+                cls._entropy_offset : cls._entropy_offset + length
+            ]
+            cls._entropy_offset += length
+        return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+    @classmethod
+    def _substitute(cls, obj, variables):
+        """Substitute $VAR/${VAR} placeholders on the string leaves of obj."""
+        if isinstance(obj, str):
+            if "$" in obj:
+                return _VAR_RE.sub(
+                    lambda m: variables.get(m.group(1) or m.group(2), m.group(0)),
+                    obj,
+                )
+            return obj
+        if isinstance(obj, dict):
+            return {k: cls._substitute(v, variables) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [cls._substitute(item, variables) for item in obj]
+        return obj
+
+    def _apply_resource(self, resource, dry_run=False):
+        """Server-side-apply a resource dict straight to the API server.
+
+        A PATCH with application/apply-patch+yaml (the dict is sent as
+        JSON, which is valid YAML) makes the server do the merge and makes
+        the call idempotent: a retried create_session converges instead of
+        failing with 409 Conflict, so no client-side rollback is needed.
+        Bypasses the typed CoreV1Api wrappers: the body is already a plain
+        dict and the response is discarded without being deserialized into
+        client models (_preload_content=False). Content negotiation stays
+        centralized here (e.g. for a future protobuf codec).
+        """
+        plural = _RESOURCE_PATHS[resource["kind"]]
+        query_params = [("fieldManager", "dozlab"), ("force", "true")]
+        if dry_run:
+            # The server validates and defaults the object but skips the
+            # etcd write, so template iteration costs no persistence.
+            query_params.append(("dryRun", "All"))
+        return self._api_client.call_api(
+            f"/api/v1/namespaces/{{namespace}}/{plural}/{{name}}",
+            "PATCH",
+            path_params={
+                "namespace": self.namespace,
+                "name": resource["metadata"]["name"],
+            },
+            query_params=query_params,
+            header_params={
+                "Content-Type": "application/apply-patch+yaml",
+                "Accept": "application/json",
+            },
+            body=resource,
+            auth_settings=["BearerToken"],
+            _preload_content=False,
+            _return_http_data_only=True,
+        )
+
+    def create_session(
+        self, user_id, rootfs_url, session_id=None, dry_run=False, **overrides
+    ):
+        """Create a lab session; returns session id and access details.
+
+        Keyword overrides (DISK_SIZE, VM_CPU, VM_MEMORY, TERMINAL_IMAGE, ...)
+        replace the template defaults. Resources are applied server-side,
+        so a failed create can simply be retried with the same session_id;
+        partially created resources converge instead of conflicting. With
+        dry_run the server validates everything but persists nothing.
+        """
+        session_id = session_id or uuid.uuid4().hex[:12]
+        variables = dict(self.defaults)
+        variables.update(
+            {
+                "SESSION_ID": session_id,
+                "USER_ID": user_id,
+                "ROOTFS_IMAGE_URL": rootfs_url,
+                "VSCODE_PASSWORD": self._generate_password(),
+            }
+        )
+        variables.update({k: v for k, v in overrides.items() if v is not None})
+
+        if self._template_docs is None:
+            resources = iter(lab_pod_template.build(variables))
+        else:
+            # Lazy: each document's substitution tree-walk happens between
+            # submissions, overlapping with requests already in flight.
+            # _substitute builds new containers, so the parsed template is
+            # never mutated and no per-call deepcopy is needed.
+            resources = (self._substitute(doc, variables) for doc in self._template_docs)
+
+        # The Pod, Service, and Secret are independent, so apply them
+        # concurrently: wall-clock drops from three API round-trips to one.
+        # Each resource is dispatched as soon as it is produced; since the
+        # applies are idempotent, bailing on a bad kind mid-stream is safe.
+        with ThreadPoolExecutor(max_workers=len(_RESOURCE_PATHS)) as executor:
+            futures = {}
+            for resource in resources:
+                if resource["kind"] not in _RESOURCE_PATHS:
+                    raise ValueError(
+                        f"Unsupported resource kind in template: {resource['kind']}"
+                    )
+                future = executor.submit(self._apply_resource, resource, dry_run)
+                futures[future] = (resource["kind"], resource["metadata"]["name"])
+            from kubernetes.client.rest import ApiException
+
+            error = None
+            for future in as_completed(futures):
+                kind, name = futures[future]
+                try:
+                    future.result()
+                    verb = "Validated" if dry_run else "Applied"
+                    print(f"[INFO] {verb} {kind}/{name}")
+                except ApiException as exc:
+                    print(f"[ERROR] Failed to apply {kind}/{name}", file=sys.stderr)
+                    error = error or exc
+
+        if error is not None:
+            # Server-side apply is idempotent, so the caller can retry the
+            # create as-is; whatever landed this time will just converge.
+            print("[ERROR] Session creation failed; retry is safe", file=sys.stderr)
+            raise error
+
+        # A cached not-found for this id (e.g. from a pre-create poll) must
+        # not outlive the create.
+        self._status_cache.pop(session_id, None)
+
+        return {
+            "session_id": session_id,
+            "user_id": user_id,
+            "service": self._names(session_id)[1],
+            "vscode_password": variables["VSCODE_PASSWORD"],
+        }
+
+    def delete_session(self, session_id):
+        """Delete all resources belonging to a session; missing ones are skipped."""
+        from kubernetes.client.rest import ApiException
+
+        self._status_cache.pop(session_id, None)
+        pod_name, service_name, secret_name = self._names(session_id)
+        # The three deletes are independent, so issue them concurrently —
+        # same shape as the create path; each tolerates 404 on its own so
+        # a partially created session still tears down cleanly.
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = {
+                executor.submit(delete_fn, name=name, namespace=self.namespace): name
+                for delete_fn, name in (
+                    (self.core_v1.delete_namespaced_pod, pod_name),
+                    (self.core_v1.delete_namespaced_service, service_name),
+                    (self.core_v1.delete_namespaced_secret, secret_name),
+                )
+            }
+            error = None
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    print(f"[INFO] Deleted {futures[future]}")
+                except ApiException as exc:
+                    if exc.status != 404:
+                        error = error or exc
+        if error is not None:
+            raise error
+
+    @staticmethod
+    def _pod_status(pod):
+        return {
+            "session_id": pod.metadata.labels.get("session-id"),
+            "user_id": pod.metadata.labels.get("user-id"),
+            "phase": pod.status.phase,
+            "created": str(pod.metadata.creation_timestamp),
+            "containers": {
+                cs.name: cs.ready for cs in pod.status.container_statuses or []
+            },
+        }
+
+    def _start_watch(self):
+        """Prime the session cache with one LIST and keep it fresh via watch.
+
+        Replaces per-call LIST/GET traffic with a single long-lived watch
+        stream, the standard informer pattern for anything that polls the
+        API server (dashboards, controllers).
+        """
+        pods = self.core_v1.list_namespaced_pod(
+            namespace=self.namespace, label_selector=LABEL_SELECTOR
+        )
+        for pod in pods.items:
+            self._session_cache[pod.metadata.labels.get("session-id")] = (
+                self._pod_status(pod)
+            )
+        self._watch_thread = threading.Thread(
+            target=self._watch_loop,
+            args=(pods.metadata.resource_version,),
+            daemon=True,
+        )
+        self._watch_thread.start()
+
+    def _watch_loop(self, resource_version):
+        from kubernetes import watch
+
+        while True:
+            try:
+                for event in watch.Watch().stream(
+                    self.core_v1.list_namespaced_pod,
+                    namespace=self.namespace,
+                    label_selector=LABEL_SELECTOR,
+                    resource_version=resource_version,
+                ):
+                    pod = event["object"]
+                    session_id = pod.metadata.labels.get("session-id")
+                    if session_id is None:
+                        continue
+                    if event["type"] == "DELETED":
+                        self._session_cache.pop(session_id, None)
+                    else:
+                        self._session_cache[session_id] = self._pod_status(pod)
+                    resource_version = pod.metadata.resource_version
+            except Exception:
+                # Watch expired or connection dropped; re-list to resync.
+                time.sleep(1)
+                try:
+                    pods = self.core_v1.list_namespaced_pod(
+                        namespace=self.namespace, label_selector=LABEL_SELECTOR
+                    )
+                except Exception:
+                    continue
+                self._session_cache.clear()
+                for pod in pods.items:
+                    self._session_cache[pod.metadata.labels.get("session-id")] = (
+                        self._pod_status(pod)
+                    )
+                resource_version = pods.metadata.resource_version
+
+    def get_session_status(self, session_id):
+        """Return a status dict for a session, or None if it does not exist.
+
+        Results on the direct path (including not-found) are served from a
+        TTL cache for up to status_ttl seconds.
+        """
+        if self._watch_thread is not None:
+            status = self._session_cache.get(session_id)
+            if status is not None:
+                return status
+            # Cache miss: the pod may have been created after the last event
+            # we processed, so fall back to a single GET.
+        from kubernetes.client.rest import ApiException
+
+        ts, status = self._status_cache.get(session_id, (0, None))
+        if time.monotonic() - ts < self.status_ttl:
+            return status
+        pod_name = self._names(session_id)[0]
+        try:
+            pod = self.core_v1.read_namespaced_pod(
+                name=pod_name, namespace=self.namespace
+            )
+            status = self._pod_status(pod)
+        except ApiException as exc:
+            if exc.status != 404:
+                raise
+            status = None
+        self._status_cache[session_id] = (time.monotonic(), status)
+        return status
+
+    def list_sessions(self):
+        """List all lab sessions in the namespace.
+
+        Without the watch cache, the server is asked for a
+        PartialObjectMetadataList: labels and timestamps are all a listing
+        needs, and metadata-only items are a fraction of the ~17KB a full
+        Pod serializes to. Pod phase lives on .status, so it only appears
+        in results served from the watch cache.
+        """
+        if self._watch_thread is not None:
+            return list(self._session_cache.values())
+        response = self._api_client.call_api(
+            "/api/v1/namespaces/{namespace}/pods",
+            "GET",
+            path_params={"namespace": self.namespace},
+            query_params=[("labelSelector", LABEL_SELECTOR)],
+            header_params={
+                "Accept": (
+                    "application/json;as=PartialObjectMetadataList;"
+                    "g=meta.k8s.io;v=v1"
+                )
+            },
+            auth_settings=["BearerToken"],
+            _preload_content=False,
+            _return_http_data_only=True,
+        )
+        sessions = []
+        for item in _loads_json(response.data)["items"]:
+            metadata = item["metadata"]
+            labels = metadata.get("labels", {})
+            sessions.append(
+                {
+                    "session_id": labels.get("session-id"),
+                    "user_id": labels.get("user-id"),
+                    "created": metadata.get("creationTimestamp"),
+                }
+            )
+        return sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage Dozlab lab sessions")
+    parser.add_argument("--namespace", default="default", help="Target namespace")
+    parser.add_argument(
+        "--template",
+        default=None,
+        help="Path to a custom session template (default: built-in manifests)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create_parser = subparsers.add_parser("create", help="Create a new lab session")
+    create_parser.add_argument("--user-id", required=True)
+    create_parser.add_argument(
+        "--rootfs-url", required=True, help="URL of the rootfs ext4 image"
+    )
+    create_parser.add_argument(
+        "--session-id", help="Reuse a session id (e.g. to retry a failed create)"
+    )
+    create_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Server-side dry run: validate and default without persisting",
+    )
+    create_parser.add_argument("--disk-size", help="VM disk size (e.g. 4G)")
+    create_parser.add_argument("--vm-cpu", help="VM CPU count")
+    create_parser.add_argument("--vm-memory", help="VM memory in MB")
+    create_parser.add_argument("--terminal-image", help="Terminal sidecar image")
+
+    delete_parser = subparsers.add_parser("delete", help="Delete a lab session")
+    delete_parser.add_argument("session_id")
+
+    status_parser = subparsers.add_parser("status", help="Show session status")
+    status_parser.add_argument("session_id")
+    status_parser.add_argument(
+        "--output",
+        choices=("json", "yaml"),
+        default="json",
+        help="Output format (default: json)",
+    )
+
+    subparsers.add_parser("list", help="List all lab sessions")
+
+    args = parser.parse_args()
+    manager = DozlabSessionManager(
+        template_path=args.template, namespace=args.namespace
+    )
+
+    if args.command == "create":
+        session = manager.create_session(
+            args.user_id,
+            args.rootfs_url,
+            session_id=args.session_id,
+            dry_run=args.dry_run,
+            DISK_SIZE=args.disk_size,
+            VM_CPU=args.vm_cpu,
+            VM_MEMORY=args.vm_memory,
+            TERMINAL_IMAGE=args.terminal_image,
+        )
+        print()
+        if args.dry_run:
+            # Nothing was persisted, so there is nothing to access.
+            print(f"Dry run passed for session: {session['session_id']}")
+        else:
+            print(f"Session created: {session['session_id']}")
+            print(f"  VS Code:   http://{session['service']}:8080")
+            print(f"  Terminal:  http://{session['service']}:8081")
+            print(f"  SSH:       {session['service']}:22")
+            print(f"  Password:  {session['vscode_password']}")
+    elif args.command == "delete":
+        manager.delete_session(args.session_id)
+    elif args.command == "status":
+        status = manager.get_session_status(args.session_id)
+        if status is None:
+            print(f"[ERROR] Session {args.session_id} not found", file=sys.stderr)
+            sys.exit(1)
+        if args.output == "yaml":
+            yaml, _, CSafeDumper = _import_yaml()
+            print(yaml.dump(status, Dumper=CSafeDumper, default_flow_style=False))
+        else:
+            sys.stdout.buffer.write(_dumps_json(status))
+            sys.stdout.buffer.write(b"\n")
+    elif args.command == "list":
+        for session in manager.list_sessions():
+            print(
+                f"{session['session_id']}  {session['user_id']}  "
+                f"{session.get('phase', '-')}  {session['created']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Python factory for the lab session manifests.
+
+This is the built-in equivalent of lab-pod-with-sidecar.yaml: build()
+returns the Pod, Service, and Secret for a session as plain dicts, ready
+to hand to the Kubernetes client. Constructing the objects directly in
+Python skips templating and YAML parsing entirely on the create path.
+
+Keep this module and lab-pod-with-sidecar.yaml in sync; the YAML remains
+the reference for kubectl-driven workflows and custom templates.
+"""
+
+# Defaults for the configurable knobs, matching the ${VAR:-default}
+# placeholders in lab-pod-with-sidecar.yaml.
+DEFAULTS = {
+    "DISK_SIZE": "4G",
+    "VM_CPU": "1",
+    "VM_MEMORY": "1024",
+    "VM_MEMORY_LIMIT": "2Gi",
+    "VM_CPU_LIMIT": "1500m",
+    "VM_MEMORY_REQUEST": "1Gi",
+    "VM_CPU_REQUEST": "500m",
+    "TERMINAL_IMAGE": "dozman99/dozlab-terminal:latest",
+    "KERNEL_SIZE_LIMIT": "2Gi",
+    "VM_DATA_SIZE_LIMIT": "5Gi",
+    "VSCODE_DATA_SIZE_LIMIT": "1Gi",
+}
+
+_NETWORK_SETUP_SCRIPT = """\
+echo "Configuring network for Firecracker VM..."
+POD_IP=$(hostname -i)
+echo "Pod IP: $POD_IP"
+
+# Network configuration for Firecracker
+# VM will use 172.16.0.2, Gateway 172.16.0.1 (configured in Firecracker)
+echo "GATEWAY_IP=172.16.0.1" > /shared/network-config
+echo "VM_IP=172.16.0.2" >> /shared/network-config
+echo "POD_IP=$POD_IP" >> /shared/network-config
+echo "TAP_DEVICE=tap0" >> /shared/network-config
+
+echo "Network configuration written to /shared/network-config"
+cat /shared/network-config
+"""
+
+_CODE_SERVER_COMMAND = """\
+# Start code-server with security headers
+exec code-server \\
+  --bind-addr 0.0.0.0:8080 \\
+  --auth password \\
+  --disable-telemetry \\
+  --disable-update-check \\
+  /workspace
+"""
+
+
+def build(variables):
+    """Return [pod, service, secret] dicts for a session.
+
+    `variables` must provide SESSION_ID, USER_ID, ROOTFS_IMAGE_URL, and
+    VSCODE_PASSWORD; any key from DEFAULTS may be overridden.
+    """
+    v = {**DEFAULTS, **variables}
+    session_id = v["SESSION_ID"]
+    pod_name = f"lab-session-{session_id}"
+    secret_name = f"lab-session-{session_id}-secrets"
+
+    pod = {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "name": pod_name,
+            "labels": {
+                "app": "lab-environment",
+                "session-id": session_id,
+                "user-id": v["USER_ID"],
+            },
+        },
+        "spec": {
+            "initContainers": [
+                # Rootfs preparation using init-setup from dozlab-rootfs-manager
+                {
+                    "name": "init-rootfs",
+                    "image": "dozman99/init-setup:latest",
+                    "env": [
+                        {"name": "IMAGE_DOWNLOAD_URL", "value": v["ROOTFS_IMAGE_URL"]},
+                        {"name": "IMAGE_SIZE", "value": v["DISK_SIZE"]},
+                        {"name": "IMAGE_PATH", "value": "/srv/vm/kernels/rootfs.ext4"},
+                    ],
+                    "volumeMounts": [
+                        {"name": "vm-kernels", "mountPath": "/srv/vm/kernels"},
+                    ],
+                    "resources": {
+                        "limits": {"memory": "256Mi", "cpu": "200m"},
+                        "requests": {"memory": "128Mi", "cpu": "100m"},
+                    },
+                },
+                # Network configuration calculator
+                {
+                    "name": "network-setup",
+                    "image": "busybox",
+                    "command": ["sh", "-c", _NETWORK_SETUP_SCRIPT],
+                    "volumeMounts": [
+                        {"name": "shared-config", "mountPath": "/shared"},
+                    ],
+                    "resources": {
+                        "limits": {"memory": "64Mi", "cpu": "100m"},
+                        "requests": {"memory": "32Mi", "cpu": "50m"},
+                    },
+                },
+            ],
+            "containers": [
+                # Firecracker MicroVM container
+                {
+                    "name": "firecracker-vm",
+                    "image": "dozman99/dozlab-firecracker:latest",
+                    "securityContext": {
+                        "capabilities": {
+                            "add": ["NET_ADMIN", "SYS_ADMIN", "SYS_RESOURCE"],
+                        },
+                    },
+                    "env": [
+                        {"name": "SESSION_ID", "value": session_id},
+                        {"name": "ROOTFS_PATH", "value": "/srv/vm/kernels/rootfs.ext4"},
+                        {"name": "KERNEL_PATH", "value": "/find/vmlinux.bin"},
+                        {"name": "CPU_COUNT", "value": v["VM_CPU"]},
+                        {"name": "MEMORY", "value": v["VM_MEMORY"]},
+                        {"name": "GATEWAY_IP", "value": "172.16.0.1"},
+                        {"name": "VM_IP", "value": "172.16.0.2"},
+                        {"name": "TAP_DEVICE_NAME", "value": "tap0"},
+                    ],
+                    "ports": [
+                        {"containerPort": 22, "name": "vm-ssh", "protocol": "TCP"},
+                    ],
+                    "resources": {
+                        "limits": {
+                            "memory": v["VM_MEMORY_LIMIT"],
+                            "cpu": v["VM_CPU_LIMIT"],
+                        },
+                        "requests": {
+                            "memory": v["VM_MEMORY_REQUEST"],
+                            "cpu": v["VM_CPU_REQUEST"],
+                        },
+                    },
+                    "volumeMounts": [
+                        {"name": "vm-kernels", "mountPath": "/srv/vm/kernels"},
+                        {"name": "vm-data", "mountPath": "/vm-data"},
+                        {
+                            "name": "shared-config",
+                            "mountPath": "/shared",
+                            "readOnly": True,
+                        },
+                    ],
+                    "livenessProbe": {
+                        "tcpSocket": {"port": 22},
+                        "initialDelaySeconds": 30,
+                        "periodSeconds": 10,
+                        "timeoutSeconds": 5,
+                        "failureThreshold": 3,
+                    },
+                    "readinessProbe": {
+                        "tcpSocket": {"port": 22},
+                        "initialDelaySeconds": 20,
+                        "periodSeconds": 5,
+                        "timeoutSeconds": 3,
+                    },
+                },
+                # Terminal sidecar container
+                {
+                    "name": "terminal-sidecar",
+                    "image": v["TERMINAL_IMAGE"],
+                    "ports": [
+                        {"containerPort": 8081, "name": "terminal", "protocol": "TCP"},
+                    ],
+                    "env": [
+                        {"name": "SESSION_ID", "value": session_id},
+                        {"name": "VM_IP", "value": "172.16.0.2"},
+                        {"name": "VM_SSH_PORT", "value": "22"},
+                    ],
+                    "resources": {
+                        "limits": {"memory": "256Mi", "cpu": "250m"},
+                        "requests": {"memory": "128Mi", "cpu": "100m"},
+                    },
+                    "volumeMounts": [
+                        {"name": "vm-data", "mountPath": "/vm-data", "readOnly": True},
+                        {
+                            "name": "shared-config",
+                            "mountPath": "/shared",
+                            "readOnly": True,
+                        },
+                    ],
+                    "livenessProbe": {
+                        "httpGet": {"path": "/health", "port": 8081},
+                        "initialDelaySeconds": 10,
+                        "periodSeconds": 10,
+                    },
+                    "readinessProbe": {
+                        "httpGet": {"path": "/ready", "port": 8081},
+                        "initialDelaySeconds": 5,
+                        "periodSeconds": 5,
+                    },
+                },
+                # VS Code Server container
+                {
+                    "name": "code-server",
+                    "image": "codercom/code-server:latest",
+                    "ports": [
+                        {"containerPort": 8080, "name": "vscode", "protocol": "TCP"},
+                    ],
+                    "env": [
+                        {
+                            "name": "PASSWORD",
+                            "valueFrom": {
+                                "secretKeyRef": {
+                                    "name": secret_name,
+                                    "key": "vscode-password",
+                                    "optional": False,
+                                },
+                            },
+                        },
+                        {"name": "SESSION_ID", "value": session_id},
+                        {"name": "DOCKER_HOST", "value": "tcp://172.16.0.2:2375"},
+                    ],
+                    "command": ["sh", "-c", _CODE_SERVER_COMMAND],
+                    "resources": {
+                        "limits": {"memory": "1Gi", "cpu": "500m"},
+                        "requests": {"memory": "512Mi", "cpu": "250m"},
+                    },
+                    "volumeMounts": [
+                        {"name": "vscode-data", "mountPath": "/home/coder"},
+                        {
+                            "name": "vm-data",
+                            "mountPath": "/workspace",
+                            "readOnly": True,
+                        },
+                        {
+                            "name": "shared-config",
+                            "mountPath": "/shared",
+                            "readOnly": True,
+                        },
+                    ],
+                    "livenessProbe": {
+                        "httpGet": {"path": "/healthz", "port": 8080},
+                        "initialDelaySeconds": 30,
+                        "periodSeconds": 10,
+                    },
+                    "readinessProbe": {
+                        "httpGet": {"path": "/healthz", "port": 8080},
+                        "initialDelaySeconds": 15,
+                        "periodSeconds": 5,
+                    },
+                    "securityContext": {
+                        "runAsNonRoot": True,
+                        "runAsUser": 1000,
+                        "allowPrivilegeEscalation": False,
+                        "readOnlyRootFilesystem": False,
+                    },
+                },
+            ],
+            "volumes": [
+                {
+                    "name": "vm-kernels",
+                    "emptyDir": {"sizeLimit": v["KERNEL_SIZE_LIMIT"]},
+                },
+                {
+                    "name": "vm-data",
+                    "emptyDir": {"sizeLimit": v["VM_DATA_SIZE_LIMIT"]},
+                },
+                {
+                    "name": "vscode-data",
+                    "emptyDir": {"sizeLimit": v["VSCODE_DATA_SIZE_LIMIT"]},
+                },
+                {
+                    "name": "shared-config",
+                    "emptyDir": {"sizeLimit": "10Mi"},
+                },
+            ],
+            "restartPolicy": "Never",
+            "securityContext": {
+                "fsGroup": 1000,
+                "runAsNonRoot": False,  # Firecracker requires root
+                "seccompProfile": {"type": "RuntimeDefault"},
+            },
+        },
+    }
+
+    service = {
+        "apiVersion": "v1",
+        "kind": "Service",
+        "metadata": {
+            "name": f"lab-service-{session_id}",
+            "labels": {
+                "app": "lab-environment",
+                "session-id": session_id,
+            },
+        },
+        "spec": {
+            "selector": {"session-id": session_id},
+            "type": "ClusterIP",
+            "ports": [
+                {"name": "vscode", "port": 8080, "targetPort": 8080, "protocol": "TCP"},
+                {
+                    "name": "terminal",
+                    "port": 8081,
+                    "targetPort": 8081,
+                    "protocol": "TCP",
+                },
+                {"name": "vm-ssh", "port": 22, "targetPort": 22, "protocol": "TCP"},
+            ],
+        },
+    }
+
+    secret = {
+        "apiVersion": "v1",
+        "kind": "Secret",
+        "metadata": {"name": secret_name},
+        "type": "Opaque",
+        "stringData": {"vscode-password": v["VSCODE_PASSWORD"]},
+    }
+
+    return [pod, service, secret]